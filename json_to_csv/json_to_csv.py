@@ -1,11 +1,46 @@
 import os
 import argparse
-import json
+import csv
 import pandas as pd
 import logging
 import sys
 from glob import glob
+import gc
 import gzip
+import io
+import mmap
+import pickle
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+# orjson parses several times faster than the standard library and accepts bytes
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# ijson streams items of a json array out of a C parser (yajl) when available
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# pyarrow reads the schema of ljson files with a multithreaded C++ parser (optional)
+try:
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+except ImportError:
+    pa = None
+
+# polars can convert ljson to csv without building any python object (optional)
+try:
+    import polars as pl
+except ImportError:
+    pl = None
 
 
 def get_args():
@@ -27,8 +62,13 @@ def get_args():
     parser.add_argument("--is_json", action='store_true', default=False, help="Indicate if input file is a json (default False)")
     parser.add_argument("--flatten_list", action='store_true', default=False, help="If true, flatten list of objects (default False)")
     parser.add_argument("--compress", action='store_true', default=False, help="Compress output using gz")
+    parser.add_argument("--n_jobs", type=int, default=1, help="Number of processes reading the files in parallel, large ljson files being split between processes (default 1)")
+    parser.add_argument("--engine", choices=['pandas', 'polars'], default='pandas', help="Engine used to convert ljson files (default pandas). polars needs pyarrow and is only used without --is_json, --flatten_list and --compress, otherwise pandas is used")
+    parser.add_argument("--format", choices=['csv', 'parquet', 'feather'], default='csv', help="Format of the output (default csv). parquet and feather need pyarrow and can not be used with --streaming, --compress only applies to csv")
 
     args = parser.parse_args()
+    if args.streaming and args.format != 'csv':
+        parser.error("--streaming only creates csv files")
     return args
 
 
@@ -54,7 +94,8 @@ def setup_custom_logger(name):
 
 def _flatten(d, parent_key='', sep='_', int_to_float=False, remove_null=False, flatten_list=False):
     """
-        Flatten a nested dictionary to one leve dictionary (recursive function)
+        Flatten a nested dictionary to one leve dictionary
+        Nested dictionaries are walked with a stack instead of recursive calls
 
         :param d: dictionary
         :param parent_key: parent_key used to create field name
@@ -66,42 +107,64 @@ def _flatten(d, parent_key='', sep='_', int_to_float=False, remove_null=False, f
         :return: list of jsons flattened
     """
 
-    items = []
-    for k, v in d.items():
-        new_key = parent_key + sep + k if parent_key else k
-        # Keep it as a list but continue to separate nested fields
-        if isinstance(v, list):
-            if flatten_list:
-                my_elems = []
-                for w in v:
-                    my_elems_w = []
-                    if isinstance(w, dict):
-                        my_elems_w.extend(_flatten(w, sep=sep, int_to_float=int_to_float, remove_null=remove_null, flatten_list=flatten_list).items())
-                    elif isinstance(w, str):
-                        my_elems.append(w)
-                        continue
-                    elif w is not None:
-                        my_elems.append(w)
-                        continue
-                    else:
-                        if not remove_null:
+    flattened = {}
+    stack = [(parent_key, d)]
+    while stack:
+        parent_key, d = stack.pop()
+        # Prefix shared by every key of this level
+        prefix = parent_key + sep if parent_key else ''
+        for k, v in d.items():
+            new_key = prefix + k
+            # Parsed jsons only contain exact types, so the type is looked up once and compared by identity
+            t = type(v)
+            if t is dict:
+                stack.append((new_key, v))
+            # Keep it as a list but continue to separate nested fields
+            elif t is list:
+                if flatten_list:
+                    my_elems = []
+                    for w in v:
+                        if type(w) is dict:
+                            # Put in in alphabetical order (keys are unique so items are sorted by key)
+                            my_elems.append(dict(sorted(_flatten(w, sep=sep, int_to_float=int_to_float, remove_null=remove_null, flatten_list=flatten_list).items())))
+                        elif w is not None:
+                            my_elems.append(w)
+                        elif not remove_null:
                             my_elems.append('null')
-                        continue
-                    # Put in in alphabetical order
-                    my_elems_w = sorted(my_elems_w, key=lambda tup: tup[0])
-                    my_elems.append(dict(my_elems_w))
-                items.append((new_key, my_elems))
-            else:
-                items.append((new_key, v))
-        elif isinstance(v, dict):
-            items.extend(_flatten(v, new_key, sep=sep, int_to_float=int_to_float, remove_null=remove_null, flatten_list=flatten_list).items())
-        else:
-            if isinstance(v, int) and int_to_float:
-                items.append((new_key, float(v)))
+                    flattened[new_key] = my_elems
+                else:
+                    flattened[new_key] = v
+            elif v is None:
+                continue
+            # Booleans are integers for python
+            elif int_to_float and (t is int or t is bool):
+                flattened[new_key] = float(v)
             else:
-                if v is not None:
-                    items.append((new_key, v))
-    return dict(items)
+                flattened[new_key] = v
+    return flattened
+
+
+def _flatten_keys(d, columns_set, sep='_'):
+    """
+        Add the keys _flatten would create for a nested dictionary to a set, without building the flattened dictionary
+        (values are not cast and lists are not walked as they do not create columns)
+
+        :param d: dictionary
+        :param columns_set: set of columns to update (updated in place)
+        :param sep: separator of nested fields
+    """
+
+    stack = [('', d)]
+    while stack:
+        parent_key, d = stack.pop()
+        prefix = parent_key + sep if parent_key else ''
+        for k, v in d.items():
+            new_key = prefix + k
+            if type(v) is dict:
+                stack.append((new_key, v))
+            # Null values are not kept by _flatten
+            elif v is not None:
+                columns_set.add(new_key)
 
 
 def _transform_jsons(json_list, sep, int_to_float, remove_null, flatten_list):
@@ -144,131 +207,272 @@ def update_df_list(df_list, json_list, sep, int_to_float, remove_null, flatten_l
     return df_list
 
 
-def update_csv(path_csv, json_list, columns, sep, int_to_float, remove_null, flatten_list, compression):
+def concat_dataframes(list_of_dfs):
+    """
+        Concatenate dataframes and sort their columns in alphabetical order
+        A single dataframe is not copied by a concatenation
+
+        :param list_of_dfs: list of dataframes
+
+        :return: dataframe
+    """
+
+    if not list_of_dfs:
+        df = pd.DataFrame()
+    elif len(list_of_dfs) == 1:
+        df = list_of_dfs[0]
+    else:
+        # Index of each dataframe is not kept (it is not dumped in the csv)
+        df = pd.concat(list_of_dfs, ignore_index=True)
+
+    # Sort columns in alphabetical order
+    return df[sorted(df.columns)]
+
+
+def open_csv(path_csv, mode='w', compression=None):
+    """
+        Open a csv and create a writer quoting every field like pandas does with quoting=1
+
+        :param path_csv: path to csv
+        :param mode: mode used to open the csv ('w' or 'a')
+        :param compression: compression algorithm (None by default)
+
+        :return: file object (to close once everything is written), csv writer
+    """
+
+    if compression == "gzip":
+        f_csv = gzip.open(path_csv, mode + 't', encoding="utf-8", newline='')
+    else:
+        # A large buffer groups the rows of a chunk in a few writes
+        f_csv = open(path_csv, mode, encoding="utf-8", newline='', buffering=1 << 20)
+    writer = csv.writer(f_csv, quoting=csv.QUOTE_ALL, lineterminator=os.linesep)
+    return f_csv, writer
+
+
+def update_csv(writer, json_list, columns, sep, int_to_float, remove_null, flatten_list):
     """
         Append a csv with json list
 
-        :param path_csv: path to csv to append
+        :param writer: csv writer of the csv to append
         :param json_list: list of json files
         :param columns: list of columns to dump (order is important)
         :param sep: separator to use when creating columns' names
         :param int_to_float: if set to true int will be casted to float
         :param remove_null: if set to true, will remove_null from json arrays
         :param flatten_list: if set to true, will flatten the content of a list of objects
-        :param compression: compression algorithm (None by default)
     """
 
     data = _transform_jsons(json_list, sep, int_to_float, remove_null, flatten_list)
-    df = pd.DataFrame(data)
-    # Add columns that are missing with nan
-    current_columns = df.columns.tolist()
-    missing_columns = [col for col in columns if col not in current_columns]
-    for col in missing_columns:
-        df[col] = ""
+    _append_csv(writer, data, columns)
+
+
+def _append_csv(writer, data, columns):
+    """
+        Append a csv with flattened jsons
 
-    # Order dataframe by the columns detected
-    df = df[columns]
-    df.to_csv(path_csv, mode='a', header=False, encoding="utf-8", index=None, quoting=1,compression=compression)
+        :param writer: csv writer of the csv to append
+        :param data: list of flattened jsons
+        :param columns: list of columns to dump (order is important)
+    """
 
-    del df
-    return
+    # Missing columns are left empty
+    writer.writerows([[js.get(col, "") for col in columns] for js in data])
 
 
-def update_columns_list(columns_list, json_list, sep, int_to_float, remove_null, flatten_list):
+def update_columns_list(columns_set, json_list, sep, int_to_float, remove_null, flatten_list, spill_file=None):
     """
         Update columns list with new json information
         Sometimes jsons do not have the same fields
         Here we make the unions of all the columns
 
-        :param columns_list: list of columns to update
+        :param columns_set: set of columns to update (updated in place)
         :param json_list: list of jsons
         :param sep: separator to use when creating columns' names
         :param int_to_float: if set to true int will be casted to float
         :param remove_null: if set to true, will remove_null from json arrays
         :param flatten_list: if set to true, will flatten the content of a list of objects
+        :param spill_file: binary file where the flattened jsons are dumped (None by default, only the keys are walked)
 
-        :return: list of columns updated
+        :return: set of columns updated
     """
+    if spill_file is None:
+        for js in json_list:
+            _flatten_keys(js, columns_set, sep=sep)
+        return columns_set
+
     data = _transform_jsons(json_list, sep, int_to_float, remove_null, flatten_list)
-    cols = []
+    pickle.dump(data, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
     for js in data:
-        cols.extend(js.keys())
-    columns_list = list(set(columns_list + cols))
+        columns_set.update(js)
+
+    return columns_set
+
+
+def _first_char(file_object):
+    """
+        Get the first non blank character of a binary file without consuming it
+
+        :param file_object: binary file object (must be seekable)
 
-    return columns_list
+        :return: first non blank character (empty bytes if the file is empty)
+    """
+    start = file_object.tell()
+    c = file_object.read(1)
+    while c.isspace():
+        c = file_object.read(1)
+    file_object.seek(start)
+    return c
+
+
+def _is_json_array(data_file):
+    """
+        Check whether a file contains a json array
+
+        :param data_file: file containing json
+
+        :return: True if the first non blank character of the file is '['
+    """
+    with open(data_file, 'rb') as f:
+        return _first_char(f) == b'['
 
 
 def read_jsons_chunks(file_object, chunk_size=10000):
     """Lazy function to read a json by chunk.
+    The file is either a json array or one (or several) json elements.
+    Only json arrays are read with ijson: top level elements can be separated by commas, which ijson does not accept.
     Default chunk size: 10k"""
 
-    # Parse the next real chunk_size lines
-    chunk = file_object.read(1000000)
+    if ijson is None or _first_char(file_object) != b'[':
+        yield from _scan_jsons_chunks(file_object, chunk_size=chunk_size)
+        return
+
+    # Elements of a json array are under the 'item' prefix
+    items = ijson.items(file_object, 'item', use_float=True, multiple_values=True)
+    while True:
+        data = list(islice(items, chunk_size))
+        if not data:
+            return
+        yield data
+
+
+# Characters to look for out of json strings when scanning a json
+_STRUCTURE_CHARS = re.compile(rb'["{}]')
+
+
+def _scan_jsons_chunks(file_object, chunk_size=10000):
+    """Lazy function to read a json by chunk without ijson.
+    The file is memory mapped and the scan jumps from one quote or bracket to the next
+    instead of reading character by character.
+    Default chunk size: 10k"""
+
+    # Empty files can not be mapped
+    if os.fstat(file_object.fileno()).st_size == 0:
+        return
+
     data = []
-    i = 0
     nb_bracket = 0
-    nb_quotes = 0
-    example = ""
-    count_escape_char = 0
-    while True:
-        # Read cahracter by character
-        for k, c in enumerate(chunk):
-            # Check quoting
-            if c == '"':
-                # Check only when '"' is a delimiter of field or value in json
-                if count_escape_char % 2 == 0:
-                    nb_quotes += 1
-            # Check beginning of brackets
-            elif c == '{' and nb_quotes % 2 == 0:
-                # Check only when '{' is a delimiter of field or value in json
-                if count_escape_char % 2 == 0:
-                    nb_bracket += 1
-            # Check ending of brackets
-            elif c == '}' and nb_quotes % 2 == 0:
-                # Check only when '"' is a delimiter of field or value in json
-                if count_escape_char % 2 == 0:
-                    nb_bracket -= 1
+    in_string = False
+    # Start of the current json example and position of the scan
+    start = 0
+    pos = 0
+    with mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        while True:
+            if in_string:
+                quote = buffer.find(b'"', pos)
+                if quote == -1:
+                    break
+                pos = quote + 1
+                # The quote is escaped when preceded by an odd number of backslashes
+                q = quote
+                while buffer[q - 1] == 0x5c:
+                    q -= 1
+                if not (quote - q) & 1:
+                    in_string = False
+                continue
+
+            match = _STRUCTURE_CHARS.search(buffer, pos)
+            if match is None:
+                break
+            pos = match.end()
+            c = match.group()
+            if c == b'"':
+                in_string = True
+            elif c == b'{':
+                # Beginning of a json example
+                if nb_bracket == 0:
+                    start = match.start()
+                nb_bracket += 1
+            elif nb_bracket > 0:
+                nb_bracket -= 1
                 # This means we finished to read one json
-                if nb_bracket == 0 and nb_quotes % 2 == 0:
-                    example += c
-                    data.append(json.loads(example))
-                    i += 1
+                if nb_bracket == 0:
+                    data.append(_json.loads(buffer[start:pos]))
                     # When chunk_size jsons obtained, dump those
-                    if i % chunk_size == 0:
-                        yield(data)
+                    if len(data) == chunk_size:
+                        yield data
                         data = []
 
-                    # Initialize those
-                    example = ""
-                    continue
-            # If we are in between 2 json examples or at the beginning
-            elif c in ['[', ',', '\n'] and nb_bracket == 0 and nb_quotes % 2 == 0:
-                continue
-            # If we are at the end of the file
-            if c in [']', ''] and nb_bracket == 0 and nb_quotes % 2 == 0:
-                # If EOF obtained or end of jsonarray send what's left of the data
-                if example == "" or example == "]":
-                    yield(data)
-                    return
-            if c == "\\":
-                count_escape_char += 1
-            else:
-                count_escape_char = 0
-            # Append character to the json example
-            example += c
-
-        # If at the end of the chunk, read new chunk
-        if k == len(chunk) - 1:
-            chunk = file_object.read(1000000)
-        # Keep what's left of the chunk
-        elif len(chunk) != 0:
-            chunk = chunk[k:]
-        # if k == 0 that means that we read the whole file
-        else:
-            break
+    # Send what's left of the data
+    if data:
+        yield data
+
+
+def split_file(data_file, shard_size=128 << 20):
+    """
+        Split a file containing one json per line in ranges of bytes ending with a line,
+        so that a large file can be processed by several processes
+
+        :param data_file: file containing one json per line
+        :param shard_size: minimum size of a range of bytes (128MB by default)
+
+        :return: list of (path, start, end) tuples, or [data_file] if the file is not split
+    """
+
+    size = os.path.getsize(data_file)
+    # Gzipped files can not be read from an offset
+    if data_file.endswith(".gz") or size <= shard_size:
+        return [data_file]
+
+    shards = []
+    start = 0
+    with open(data_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        while start < size:
+            # Each range ends after the first line break following shard_size bytes
+            end = mm.find(b'\n', start + shard_size)
+            end = size if end == -1 else end + 1
+            shards.append((data_file, start, end))
+            start = end
+    return shards
+
+
+def read_lines(data_file):
+    """Lazy function to read the lines of a file (gzipped or not), or of a (path, start, end) range of a file.
+    Files that are not gzipped are memory mapped instead of being copied in a read buffer"""
+
+    start, end = 0, None
+    if isinstance(data_file, tuple):
+        data_file, start, end = data_file
+
+    if data_file.endswith(".gz"):
+        # GzipFile splits lines out of small reads, a large buffer on top of it is quicker
+        with gzip.open(data_file) as gz, io.BufferedReader(gz, buffer_size=1 << 20) as f:
+            yield from f
+        return
+
+    with open(data_file, 'rb') as f:
+        # Empty files can not be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if end is None:
+                yield from iter(mm.readline, b'')
+                return
+            mm.seek(start)
+            while mm.tell() < end:
+                yield mm.readline()
 
 
-def get_columns(list_data_paths, sep, logger, int_to_float, remove_null, is_json, flatten_list):
+def get_columns(list_data_paths, sep, logger, int_to_float, remove_null, is_json, flatten_list, spill_file=None):
     """
         Get the columns created accordingly to a list of files containing json
 
@@ -279,11 +483,12 @@ def get_columns(list_data_paths, sep, logger, int_to_float, remove_null, is_json
         :param remove_null: if set to true, will remove_null from json arrays
         :param is_json: if set to true, inputs are considered as valid json
         :param flatten_list: if set to true, will flatten the content of a list of objects
+        :param spill_file: binary file where the flattened jsons are dumped to avoid reading the files twice (None by default)
 
-        :return: Exhaustive list of columns
+        :return: Exhaustive list of columns (sorted in alphabetical order)
     """
 
-    columns_list = []
+    columns_set = set()
 
     j = 0
     chunk_size = 50000
@@ -292,134 +497,505 @@ def get_columns(list_data_paths, sep, logger, int_to_float, remove_null, is_json
         json_list = []
         # If we deal with json (or json array) file
         if is_json:
-            f = open(data_file)
-            # Read json file by chunk
-            for x in read_jsons_chunks(f, chunk_size=chunk_size):
-                if j != 0 and (j % chunk_size == 0):
-                    columns_list = update_columns_list(columns_list, json_list, sep, int_to_float, remove_null, flatten_list)
-                    logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_list)) + ' columns found')
+            with open(data_file, 'rb') as f:
+                # Read json file by chunk, each chunk is used as soon as it is read
+                for x in read_jsons_chunks(f, chunk_size=chunk_size):
+                    j += len(x)
+                    update_columns_list(columns_set, x, sep, int_to_float, remove_null, flatten_list, spill_file)
+                    logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_set)) + ' columns found')
+        # If we deal with ljson
+        else:
+            for i, line in enumerate(read_lines(data_file)):
+                j += 1
+                if (j % 50000 == 0):
+                    update_columns_list(columns_set, json_list, sep, int_to_float, remove_null, flatten_list, spill_file)
+                    logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_set)) + ' columns found')
                     json_list = []
                 try:
-                    json_list.extend(x)
-                    # Maximum of chunk_size elements were added
-                    j += chunk_size
+                    json_list.append(_json.loads(line))
                 except Exception:
-                    logger.info("Json in line " + str(j) + " (in file: " + data_file + ") does not seem well formed. Example was skipped")
+                    logger.info("Json in line " + str(i) + " (in file: " + str(data_file) + ") does not seem well formed. Example was skipped")
                     continue
-        # If we deal with ljson
-        else:
-            fuc = lambda x: open(x)
-            if data_file.endswith(".gz"):
-                fuc = lambda x: gzip.open(x)
-            with fuc(data_file) as f:
-                for i, line in enumerate(f):
-                    j += 1
-                    if (j % 50000 == 0):
-                        columns_list = update_columns_list(columns_list, json_list, sep, int_to_float, remove_null, flatten_list)
-                        logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_list)) + ' columns found')
-                        json_list = []
-                    try:
-                        json_list.append(json.loads(line))
-                    except Exception:
-                        logger.info("Json in line " + str(i) + " (in file: " + data_file + ") does not seem well formed. Example was skipped")
-                        continue
         # A quicker solution would be to join directly to create a valid json
         if (len(json_list) > 0):
-            columns_list = update_columns_list(columns_list, json_list, sep, int_to_float, remove_null, flatten_list)
-            logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_list)) + ' columns found')
+            update_columns_list(columns_set, json_list, sep, int_to_float, remove_null, flatten_list, spill_file)
+            logger.info('Iteration ' + str(j) + ': Updating columns ===> ' + str(len(columns_set)) + ' columns found')
 
     # Concatenate the dataframes created
-    logger.info('Full column\'s list obtained: ' + str(len(columns_list)) + ' fields found')
-    return columns_list
+    logger.info('Full column\'s list obtained: ' + str(len(columns_set)) + ' fields found')
+    # Sort columns in alphabetical order
+    return sorted(columns_set)
+
 
+def _arrow_columns(fields, sep, parent_key=''):
+    """
+        Get the columns' names of flattened jsons from the fields of a pyarrow schema (recursive function)
+
+        :param fields: pyarrow schema or struct type
+        :param sep: separator to use when creating columns' names
+        :param parent_key: parent_key used to create field name
 
-def get_dataframe(list_data_paths, columns=None, path_csv=None, logger=None, sep='.', int_to_float=False, remove_null=False, is_json=False, flatten_list=False, compression=None):
+        :return: list of columns
+    """
+
+    columns = []
+    for field in fields:
+        new_key = parent_key + sep + field.name if parent_key else field.name
+        if pa.types.is_struct(field.type):
+            columns.extend(_arrow_columns(field.type, sep, new_key))
+        # Fields always null are not kept when flattening, lists are kept as they are
+        elif not pa.types.is_null(field.type):
+            columns.append(new_key)
+    return columns
+
+
+def read_blocks(data_file, block_size=32 << 20):
+    """Lazy function to read a file containing one json per line (gzipped or not) in blocks of bytes ending with a line.
+    Blocks are a bit larger than block_size, so that only one of them is held in memory at a time"""
+
+    if data_file.endswith(".gz"):
+        with gzip.open(data_file) as gz, io.BufferedReader(gz, buffer_size=1 << 20) as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    return
+                yield block + f.readline()
+
+    shards = split_file(data_file, block_size)
+    with open(data_file, 'rb') as f:
+        # Small files are not split
+        if not isinstance(shards[0], tuple):
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for _, start, end in shards:
+                yield mm[start:end]
+
+
+def _arrow_schemas(data_file):
+    """Lazy function to infer the schema of each block of a file containing one json per line with pyarrow's json reader.
+    Raise a pyarrow.ArrowException if pyarrow can not read a block"""
+
+    read_options = pa_json.ReadOptions(use_threads=True, block_size=8 << 20)
+    for block in read_blocks(data_file):
+        # pyarrow does not read blocks without any json
+        if not block or block.isspace():
+            continue
+        yield pa_json.read_json(pa.BufferReader(block), read_options=read_options).schema
+
+
+def get_columns_arrow(list_data_paths, sep, logger):
+    """
+        Get the columns created accordingly to a list of files containing one json per line
+        Schemas are inferred by pyarrow's json reader instead of flattening every json.
+        Files are read in blocks ending with a line so that a file is never loaded at once:
+        columns of the blocks are merged like the columns of the jsons (a field can be a value in a block and an object in another)
+
+        :param list_data_paths: list of files containing one json per line
+        :param sep: separator to use when creating columns' names
+        :param logger: logger (used to print)
+
+        :return: Exhaustive list of columns (sorted in alphabetical order), None if pyarrow can not read a block
+                 (fields changing type, lists mixing objects and values, malformed jsons...)
+    """
+
+    columns_set = set()
+    for data_file in list_data_paths:
+        logger.info(data_file)
+        try:
+            for schema in _arrow_schemas(data_file):
+                columns_set.update(_arrow_columns(schema, sep))
+        except pa.ArrowException as e:
+            logger.info("pyarrow could not infer the columns of " + data_file + " (" + str(e) + ")")
+            return None
+        logger.info('Updating columns ===> ' + str(len(columns_set)) + ' columns found')
+
+    logger.info('Full column\'s list obtained: ' + str(len(columns_set)) + ' fields found')
+    # Sort columns in alphabetical order
+    return sorted(columns_set)
+
+
+def get_schema_arrow(list_data_paths, logger):
+    """
+        Get the schema of a list of files containing one json per line with pyarrow's strict inference
+        Files are read in blocks ending with a line, schemas of the blocks must be compatible
+        (only nulls, integers becoming floats and new fields of objects are merged)
+
+        :param list_data_paths: list of files containing one json per line
+        :param logger: logger (used to print)
+
+        :return: pyarrow schema, None if a field changes type or pyarrow can not read a block
+    """
+
+    try:
+        schemas = [schema for data_file in list_data_paths for schema in _arrow_schemas(data_file)]
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except pa.ArrowException as e:
+        logger.info("pyarrow could not infer the types of the fields (" + str(e) + ")")
+        return None
+
+
+def get_dataframe(list_data_paths, columns=None, writer=None, logger=None, sep='.', int_to_float=False, remove_null=False, is_json=False, flatten_list=False):
     """
         Get dataframe from files containing one json per line
 
         :param list_data_paths: list of files containing one json per line
         :param columns_list: list of columns to update
-        :param path_csv: path to csv output if streaming
+        :param writer: csv writer of the output if streaming (rows are appended)
         :param logger: logger (used to print)
         :param sep: separator to use when creating columns' names
         :param int_to_float: if set to true int will be casted to float
         :param remove_null: if set to true, will remove_null from json arrays
         :param is_json: if set to true, inputs are considered as valid json
         :param flatten_list: if set to true, will flatten the content of a list of objects
-        :param compression: compression algorithm (None by default)
-
 
         :return: dataframe or nothing if the dataframe is generated while streaming the files
     """
 
-    json_list = []
+    list_of_dfs = []
     j = 0
     chunk_size = 50000
-    for data_file in list_data_paths:
-        logger.info(data_file)
-        json_list = []
-        # If we deal with json (or json array) file
-        if is_json:
-            f = open(data_file)
-            # Read json file by chunk
-            for x in read_jsons_chunks(f, chunk_size=chunk_size):
-                if j != 0 and (j % chunk_size == 0):
-                    logger.info('Iteration ' + str(j) + ': Creating sub dataframe')
-                    if columns:
-                        update_csv(path_csv, json_list, columns, sep, int_to_float, remove_null, flatten_list, compression)
-                        json_list = []
-                try:
-                    json_list.extend(x)
-                    # Maximum of chunk_size elements were added
-                    j += chunk_size  # -1 because we add 1 at the beginning of the loop
-                except Exception:
-                    logger.info("Json in line " + str(j) + " (in file: " + data_file + ") does not seem well formed. Example was skipped")
-                    continue
-        # If we deal with ljson
-        else:
-            fuc = lambda x: open(x)
-            if data_file.endswith(".gz"):
-                fuc = lambda x: gzip.open(x)
-            with fuc(data_file) as f:
-                for i, line in enumerate(f):
+    # Parsed jsons hold no reference cycles: the garbage collector would only walk
+    # the dataframes already created again and again, so it is paused while reading
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for data_file in list_data_paths:
+            logger.info(data_file)
+            json_list = []
+            # If we deal with json (or json array) file
+            if is_json:
+                with open(data_file, 'rb') as f:
+                    # Read json file by chunk, each chunk is used as soon as it is read
+                    for x in read_jsons_chunks(f, chunk_size=chunk_size):
+                        j += len(x)
+                        logger.info('Iteration ' + str(j) + ': Creating sub dataframe')
+                        if columns:
+                            update_csv(writer, x, columns, sep, int_to_float, remove_null, flatten_list)
+                        else:
+                            list_of_dfs = update_df_list(list_of_dfs, x, sep, int_to_float, remove_null, flatten_list)
+            # If we deal with ljson while streaming, each json is written as soon as it is read
+            elif columns:
+                writerow = writer.writerow
+                for i, line in enumerate(read_lines(data_file)):
+                    j += 1
+                    if (j % 100000 == 0):
+                        logger.info(str(i) + ' documents processed')
+                    try:
+                        js = _json.loads(line)
+                    except Exception:
+                        logger.info("Json in line " + str(i) + " (in file: " + str(data_file) + ") does not seem well formed. Example was skipped")
+                        continue
+                    js = _flatten(js, sep=sep, int_to_float=int_to_float, remove_null=remove_null, flatten_list=flatten_list)
+                    writerow([js.get(col, "") for col in columns])
+            # If we deal with ljson
+            else:
+                for i, line in enumerate(read_lines(data_file)):
                     j += 1
                     if (j % 50000 == 0):
                         logger.info('Iteration ' + str(j) + ': Creating sub dataframe')
-                        if columns:
-                            update_csv(path_csv, json_list, columns, sep, int_to_float, remove_null, flatten_list, compression)
-                            json_list.clear()
+                        list_of_dfs = update_df_list(list_of_dfs, json_list, sep, int_to_float, remove_null, flatten_list)
+                        json_list.clear()
 
                     if (j % 100000 == 0):
                         logger.info(str(i) + ' documents processed')
                     try:
-                        json_list.append(json.loads(line))
+                        json_list.append(_json.loads(line))
                     except Exception:
-                        logger.info("Json in line " + str(i) + " (in file: " + data_file + ") does not seem well formed. Example was skipped")
+                        logger.info("Json in line " + str(i) + " (in file: " + str(data_file) + ") does not seem well formed. Example was skipped")
                         continue
 
-        # A quicker solution would be to join directly to create a valid json
-        logger.info('Convert to DataFrame')
-        if (len(json_list) > 0):
-            logger.info('Iteration ' + str(j) + ': Creating last sub dataframe')
-            if columns:
-                logger.info("updating csv with new data " + path_csv)
-                update_csv(path_csv, json_list, columns, sep, int_to_float, remove_null, flatten_list, compression)
-                json_list.clear()
+                # A quicker solution would be to join directly to create a valid json
+                logger.info('Convert to DataFrame')
+                if (len(json_list) > 0):
+                    logger.info('Iteration ' + str(j) + ': Creating last sub dataframe')
+                    list_of_dfs = update_df_list(list_of_dfs, json_list, sep, int_to_float, remove_null, flatten_list)
+                    json_list.clear()
+    finally:
+        if gc_enabled:
+            gc.enable()
 
     if not columns:
         # Concatenate the dataframes created
-        list_of_dfs = update_df_list([], json_list, sep, int_to_float, remove_null, flatten_list)
         logger.info('Concatenate ' + str(len(list_of_dfs)) + ' DataFrames')
-        df = pd.concat(list_of_dfs)
+        return concat_dataframes(list_of_dfs)
 
-        # Sort columns in alphabetical order
-        columns_list = list(df.columns.values)
-        columns_list.sort()
 
-        return df[columns_list]
-    else:
+def write_dataframe(df, path_output, output_format='csv', compression=None):
+    """
+        Dump a dataframe in a csv, parquet or feather file
+        Columns arrow can not convert (e.g. lists of objects mixed with other values) are stored as strings, like in the csv.
+        Parquet files are compressed with zstd
+
+        :param df: dataframe
+        :param path_output: path to output
+        :param output_format: 'csv', 'parquet' or 'feather' (csv by default)
+        :param compression: compression algorithm of the csv (None by default)
+    """
+
+    if output_format == 'csv':
+        df.to_csv(path_output, encoding="utf-8", index=None, quoting=1, compression=compression)
         return
 
+    if pa is not None:
+        for col in df.columns[df.dtypes == object]:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].map(str, na_action='ignore')
+    df = df.reset_index(drop=True)
+    if output_format == 'parquet':
+        df.to_parquet(path_output, index=False, compression='zstd')
+    else:
+        df.to_feather(path_output)
+
+
+def read_spilled_chunks(spill_file):
+    """Lazy function to read the flattened jsons dumped by get_columns.
+    Chunks are yielded in the order they were dumped"""
+
+    spill_file.seek(0)
+    while True:
+        try:
+            yield pickle.load(spill_file)
+        except EOFError:
+            return
+
+
+def _spill_file_columns(data_file, spill_dir, sep, logger, int_to_float, remove_null, is_json, flatten_list):
+    """
+        Get the columns of a file and dump its flattened jsons in a new spill file (run by each process)
+
+        :param data_file: file containing json
+        :param spill_dir: folder where the spill file is created
+        :param sep: separator to use when creating columns' names
+        :param logger: logger (used to print)
+        :param int_to_float: if set to true int will be casted to float
+        :param remove_null: if set to true, will remove_null from json arrays
+        :param is_json: if set to true, inputs are considered as valid json
+        :param flatten_list: if set to true, will flatten the content of a list of objects
+
+        :return: list of columns of the file, path to the spill file
+    """
+
+    with tempfile.NamedTemporaryFile(dir=spill_dir, delete=False) as spill_file:
+        try:
+            columns_list = get_columns([data_file], sep, logger, int_to_float, remove_null, is_json, flatten_list, spill_file)
+        except BaseException:
+            spill_file.close()
+            os.remove(spill_file.name)
+            raise
+    return columns_list, spill_file.name
+
+
+def _spill_to_csv(spill_path, path_csv, columns, compression):
+    """
+        Dump the flattened jsons of a spill file in a csv without header and remove the spill file (run by each process)
+
+        :param spill_path: path to the spill file
+        :param path_csv: path to the csv to create
+        :param columns: list of columns to dump (order is important)
+        :param compression: compression algorithm (None by default)
+    """
+
+    f_csv, writer = open_csv(path_csv, 'w', compression)
+    with f_csv, open(spill_path, 'rb') as spill_file:
+        for json_list in read_spilled_chunks(spill_file):
+            _append_csv(writer, json_list, columns)
+    os.remove(spill_path)
+
+
+def get_csv_parallel(list_data_paths, path_csv, logger, n_jobs, sep='.', int_to_float=False, remove_null=False, is_json=False, flatten_list=False, compression=None):
+    """
+        Create the csv in a streaming way, files being processed in parallel
+        Each process gets the columns of a file while dumping its flattened jsons,
+        then writes them in its own part of the csv once every column is known.
+        Parts are concatenated in the order of the files.
+
+        :param list_data_paths: list of files containing json
+        :param path_csv: path to csv output
+        :param logger: logger (used to print)
+        :param n_jobs: number of processes
+        :param sep: separator to use when creating columns' names
+        :param int_to_float: if set to true int will be casted to float
+        :param remove_null: if set to true, will remove_null from json arrays
+        :param is_json: if set to true, inputs are considered as valid json
+        :param flatten_list: if set to true, will flatten the content of a list of objects
+        :param compression: compression algorithm (None by default)
+    """
+
+    spill_dir = os.path.dirname(os.path.abspath(path_csv))
+    part_paths = [path_csv + '.part' + str(i) for i in range(len(list_data_paths))]
+    spill_columns = partial(_spill_file_columns, spill_dir=spill_dir, sep=sep, logger=logger, int_to_float=int_to_float,
+                            remove_null=remove_null, is_json=is_json, flatten_list=flatten_list)
+    futures = []
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(spill_columns, data_file) for data_file in list_data_paths]
+            results = [future.result() for future in futures]
+
+            # Sort columns in alphabetical order
+            columns_list = sorted(set().union(*[columns for columns, _ in results]))
+            logger.info('Full column\'s list obtained: ' + str(len(columns_list)) + ' fields found')
+            f_csv, writer = open_csv(path_csv, 'w', compression)
+            with f_csv:
+                writer.writerow(columns_list)
+
+            spill_paths = [spill_path for _, spill_path in results]
+            list(executor.map(partial(_spill_to_csv, columns=columns_list, compression=compression), spill_paths, part_paths))
+
+        logger.info('Concatenate ' + str(len(part_paths)) + ' parts of the csv')
+        with open(path_csv, 'ab') as f_csv:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as f_part:
+                    shutil.copyfileobj(f_part, f_csv)
+                os.remove(part_path)
+    finally:
+        # Remove the spill files and parts left when a process failed (nothing is left on success)
+        spill_paths = [future.result()[1] for future in futures if not future.cancelled() and future.exception() is None]
+        for path in spill_paths + part_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_dataframe_parallel(list_data_paths, logger, n_jobs, sep='.', int_to_float=False, remove_null=False, is_json=False, flatten_list=False):
+    """
+        Get dataframe from files containing json, each file being processed by one of the processes
+
+        :param list_data_paths: list of files containing json
+        :param logger: logger (used to print)
+        :param n_jobs: number of processes
+        :param sep: separator to use when creating columns' names
+        :param int_to_float: if set to true int will be casted to float
+        :param remove_null: if set to true, will remove_null from json arrays
+        :param is_json: if set to true, inputs are considered as valid json
+        :param flatten_list: if set to true, will flatten the content of a list of objects
+
+        :return: dataframe
+    """
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        file_dataframe = partial(get_dataframe, logger=logger, sep=sep, int_to_float=int_to_float, remove_null=remove_null,
+                                 is_json=is_json, flatten_list=flatten_list)
+        list_of_dfs = list(executor.map(file_dataframe, [[data_file] for data_file in list_data_paths]))
+
+    logger.info('Concatenate ' + str(len(list_of_dfs)) + ' DataFrames')
+    return concat_dataframes(list_of_dfs)
+
+
+def _arrow_lists(fields, sep, parent_key=''):
+    """
+        Get the columns' names of the lists of a pyarrow schema (recursive function)
+
+        :param fields: pyarrow schema or struct type
+        :param sep: separator to use when creating columns' names
+        :param parent_key: parent_key used to create field name
+
+        :return: list of columns holding lists
+    """
+
+    columns = []
+    for field in fields:
+        new_key = parent_key + sep + field.name if parent_key else field.name
+        if pa.types.is_struct(field.type):
+            columns.extend(_arrow_lists(field.type, sep, new_key))
+        elif pa.types.is_list(field.type):
+            columns.append(new_key)
+    return columns
+
+
+def _polars_dtype(arrow_type):
+    """
+        Convert a pyarrow type inferred from jsons to a polars dtype (recursive function)
+
+        :param arrow_type: pyarrow type
+
+        :return: polars dtype
+    """
+
+    if pa.types.is_struct(arrow_type):
+        return pl.Struct([pl.Field(field.name, _polars_dtype(field.type)) for field in arrow_type])
+    # pyarrow parses dates out of strings, they are written as they are in the jsons
+    if pa.types.is_timestamp(arrow_type):
+        return pl.String
+    return pl.from_arrow(pa.array([], type=arrow_type)).dtype
+
+
+def _polars_columns(schema, parent_path=()):
+    """
+        List the leaf columns of a polars schema (recursive function)
+
+        :param schema: polars schema or struct fields
+        :param parent_path: path of the parent struct
+
+        :return: list of (path of the field, dtype of the field)
+    """
+
+    columns = []
+    for name, dtype in schema.items():
+        path = parent_path + (name,)
+        if isinstance(dtype, pl.Struct):
+            columns.extend(_polars_columns({f.name: f.dtype for f in dtype.fields}, path))
+        # Fields always null are not kept when flattening
+        elif dtype != pl.Null:
+            columns.append((path, dtype))
+    return columns
+
+
+def get_csv_polars(list_data_paths, path_csv, logger, sep='.', int_to_float=False):
+    """
+        Create the csv from files containing one json per line using polars
+        Files are scanned, flattened and dumped in a streaming way without loading every json in memory
+
+        :param list_data_paths: list of files containing one json per line
+        :param path_csv: path to csv output
+        :param logger: logger (used to print)
+        :param sep: separator to use when creating columns' names
+        :param int_to_float: if set to true int will be casted to float
+
+        :return: True if the csv was created, False if polars can not handle those files
+    """
+
+    # polars turns fields changing type into strings instead of failing, so types are checked by pyarrow first
+    if pa is None:
+        logger.info("pyarrow is needed to check the types of the fields")
+        return False
+    schema = get_schema_arrow(list_data_paths, logger)
+    if schema is None:
+        return False
+    # Lists can not be written in a csv by polars
+    lists = _arrow_lists(schema, sep)
+    if lists:
+        logger.info("Polars can not dump the lists in " + ', '.join(lists))
+        return False
+
+    # The schema is given to polars so that the files are not parsed again to infer it
+    schema = {field.name: _polars_dtype(field.type) for field in schema}
+    lf = pl.scan_ndjson(list_data_paths, schema=schema)
+
+    exprs = []
+    for path, dtype in _polars_columns(schema):
+        expr = pl.col(path[0])
+        for name in path[1:]:
+            expr = expr.struct.field(name)
+        # Booleans are integers for python
+        if int_to_float and (dtype.is_integer() or dtype == pl.Boolean):
+            expr = expr.cast(pl.Float64)
+        elif dtype == pl.Boolean:
+            # Keep python's representation of booleans
+            expr = expr.replace_strict({True: 'True', False: 'False'}, return_dtype=pl.String)
+        exprs.append(expr.alias(sep.join(path)))
+
+    # Sort columns in alphabetical order
+    exprs.sort(key=lambda expr: expr.meta.output_name())
+    logger.info(str(len(exprs)) + ' fields found')
+    try:
+        lf.select(exprs).sink_csv(path_csv, quote_style='always')
+    except pl.exceptions.PolarsError as e:
+        logger.info("Polars could not convert the files (" + str(e) + ")")
+        return False
+    return True
+
 
 def main(logger):
     """
@@ -444,26 +1020,67 @@ def main(logger):
         data = [opt.path_data_jsonperline]
 
     compression="gzip" if opt.compress else None
+    if opt.engine == 'polars' and opt.format == 'csv':
+        if pl is None:
+            logger.info("polars is not installed, using pandas instead")
+        elif opt.is_json or opt.flatten_list or opt.compress or any(path.endswith(".gz") for path in data):
+            logger.info("polars does not handle those options, using pandas instead")
+        elif get_csv_polars(data, opt.path_output, logger, sep=opt.sep, int_to_float=opt.int_to_float):
+            logger.info('Csv successfully created and dumped')
+            return 0
+        else:
+            logger.info("Using pandas instead")
+
+    if opt.n_jobs > 1 and not opt.is_json:
+        # Large files are split in ranges of up to 128MB so that each process gets a similar amount of lines
+        total_size = sum(os.path.getsize(data_file) for data_file in data)
+        shard_size = max(8 << 20, min(128 << 20, total_size // opt.n_jobs))
+        data = [shard for data_file in data for shard in split_file(data_file, shard_size)]
+    if opt.n_jobs > 1 and len(data) > 1:
+        logger.info('Processing ' + str(len(data)) + ' files (or ranges of files) with ' + str(opt.n_jobs) + ' processes')
+        if opt.streaming:
+            get_csv_parallel(data, opt.path_output, logger, opt.n_jobs, sep=opt.sep, int_to_float=opt.int_to_float, remove_null=opt.remove_null, is_json=opt.is_json, flatten_list=opt.flatten_list, compression=compression)
+        else:
+            df = get_dataframe_parallel(data, logger, opt.n_jobs, sep=opt.sep, int_to_float=opt.int_to_float, remove_null=opt.remove_null, is_json=opt.is_json, flatten_list=opt.flatten_list)
+            logger.info("saving data to " + opt.path_output)
+            write_dataframe(df, opt.path_output, opt.format, compression)
     # Get list of columns if in streaming
-    columns_list = None
-    if opt.streaming:
-        columns_list = get_columns(data, opt.sep, logger, opt.int_to_float, opt.remove_null, opt.is_json, opt.flatten_list)
-        # Sort columns in alphabetical order
-        columns_list.sort()
-        df = pd.DataFrame(columns=columns_list)
-        logger.info(columns_list)
-
-        # Dump empty dataframes with columns
-        df.to_csv(opt.path_output, encoding="utf-8", index=None, quoting=1,compression=compression)
-
-
-    # Get dataframe
-    df = get_dataframe(data, columns=columns_list, path_csv=opt.path_output, logger=logger, sep=opt.sep, int_to_float=opt.int_to_float, remove_null=opt.remove_null, is_json=opt.is_json, flatten_list=opt.flatten_list, compression=compression)
-    if not opt.streaming:
+    elif opt.streaming:
+        # Columns are read by pyarrow when possible, it is quicker than walking the keys of the jsons
+        columns_list = None
+        if pa is not None and not opt.is_json:
+            columns_list = get_columns_arrow(data, opt.sep, logger)
+        # Reading the files twice is quicker than dumping flattened jsons, unless json files are scanned
+        # (without ijson, or when they are not json arrays)
+        if columns_list is None and (not opt.is_json or (ijson is not None and all(_is_json_array(data_file) for data_file in data))):
+            columns_list = get_columns(data, opt.sep, logger, opt.int_to_float, opt.remove_null, opt.is_json, opt.flatten_list)
+        if columns_list is not None:
+            logger.info(columns_list)
+            f_csv, writer = open_csv(opt.path_output, 'w', compression)
+            with f_csv:
+                # Dump columns as header
+                writer.writerow(columns_list)
+                get_dataframe(data, columns=columns_list, writer=writer, logger=logger, sep=opt.sep, int_to_float=opt.int_to_float, remove_null=opt.remove_null, is_json=opt.is_json, flatten_list=opt.flatten_list)
+        else:
+            # Flattened jsons are dumped next to the output while getting the columns so files are read only once
+            with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(opt.path_output))) as spill_file:
+                columns_list = get_columns(data, opt.sep, logger, opt.int_to_float, opt.remove_null, opt.is_json, opt.flatten_list, spill_file)
+                logger.info(columns_list)
+
+                f_csv, writer = open_csv(opt.path_output, 'w', compression)
+                with f_csv:
+                    # Dump columns as header
+                    writer.writerow(columns_list)
+                    for j, json_list in enumerate(read_spilled_chunks(spill_file)):
+                        logger.info('Chunk ' + str(j) + ': Updating csv')
+                        _append_csv(writer, json_list, columns_list)
+    else:
+        # Get dataframe
+        df = get_dataframe(data, logger=logger, sep=opt.sep, int_to_float=opt.int_to_float, remove_null=opt.remove_null, is_json=opt.is_json, flatten_list=opt.flatten_list)
         logger.info("saving data to " + opt.path_output)
-        df.to_csv(opt.path_output, encoding="utf-8", index=None, quoting=1, compression=compression)
+        write_dataframe(df, opt.path_output, opt.format, compression)
 
-    logger.info('Csv successfully created and dumped')
+    logger.info(opt.format.capitalize() + ' successfully created and dumped')
     return 0
 
 
@@ -21,7 +21,7 @@ setup(name='json-to-csv',
                    'Programming Language :: Python :: 3.5',
                    ],
       install_requires=[],
-      extras_require={},
+      extras_require={'speedups': ['orjson', 'ijson', 'pyarrow'], 'polars': ['polars']},
       packages=find_packages(),
       entry_points={
           'console_scripts': [